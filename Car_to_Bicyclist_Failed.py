@@ -5,53 +5,142 @@ import pygame
 import sys
 import os
 import socket
+import select
 import struct
+import logging
+import argparse
+import matplotlib
+
+# AEB_LIVE_PLOT=1 : fenêtre Tk interactive ; sinon rendu hors écran (Agg) dans LIVE_PLOT_FILE
+LIVE_PLOT = os.environ.get('AEB_LIVE_PLOT') == '1'
+LIVE_PLOT_FILE = 'live.png'
+if not LIVE_PLOT:
+    matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
-from collections import deque
+import numpy as np
 import threading
+import multiprocessing
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from numba import njit
+except ImportError:  # Numba absent : la logique AEB s'exécute en Python pur
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+# Trame Simulink (les deux sens) : marqueur b'AEB\0' + longueur uint32 + charge utile
+# Formats compilés une seule fois et réutilisés à chaque tick
+_MAGIC = b'AEB\0'
+HEADER_FMT = struct.Struct('<4sI')
+# Paquet envoyé à Simulink : MIO_Distance, MIO_Velocity, Ego_Velocity (3 doubles, 24 octets)
+SEND_FMT = struct.Struct('<3d')
+# Paquet reçu de Simulink : egoCarStop, FCW_Activate, Deceleration, AEB_Status, Emergency_Brake
+RECV_FMT = struct.Struct('<5d')
+# Trame d'émission préallouée : l'entête est fixe, seule la charge utile est réécrite
+_tx = bytearray(HEADER_FMT.size + SEND_FMT.size)
+HEADER_FMT.pack_into(_tx, 0, _MAGIC, SEND_FMT.size)
+_rx = bytearray(4096)  # Tampon de réception réutilisé à chaque tick
+_rx_view = memoryview(_rx)
+_rx_pending = bytearray()  # Octets reçus mais pas encore décodés (paquet à cheval sur deux ticks)
+
+# Journalisation : les traces par tick ([SEND]/[RECV]) ne sont émises qu'en mode --verbose
+log = logging.getLogger('aeb')
+
+# Vector3D.length() (calcul C++) n'existe pas sur toutes les versions de CARLA
+_HAS_VECTOR_LENGTH = hasattr(carla.Vector3D, 'length')
 
 def get_speed(vehicle):
     velocity = vehicle.get_velocity()
-    return math.sqrt(velocity.x**2 + velocity.y**2 + velocity.z**2)
+    if _HAS_VECTOR_LENGTH:
+        return velocity.length()
+    return math.hypot(velocity.x, velocity.y, velocity.z)
+
+@njit(cache=True, fastmath=True)
+def aeb_step(distance, distance_sq, relative_velocity):
+    """Time-To-Collision et décision AEB locale (seuils nocturnes) -> (ttc, aeb, urgence, décélération)
 
-def calculate_ttc(distance, relative_velocity):
-    """Calcule le Time-To-Collision"""
+    Les seuils sont comparés à la distance au carré (distance_sq) ; distance sert au TTC.
+    """
     if relative_velocity <= 0:
-        return float('inf')  # Pas de collision si vitesse relative <= 0
-    return distance / relative_velocity
+        return math.inf, False, False, 0.0  # Pas de collision si vitesse relative <= 0
+    ttc = distance / relative_velocity
+    # Seuils plus conservateurs la nuit : détection à 15 m, freinage d'urgence à 8 m
+    aeb_status = distance_sq < 225.0  # 15 m
+    emergency_brake = aeb_status and distance_sq < 64.0  # 8 m
+    # Freinage plus doux sur route mouillée
+    deceleration = min(0.8, 15.0 / distance) if emergency_brake else 0.0
+    return ttc, aeb_status, emergency_brake, deceleration
 
 def setup_tcp_server(port=9001):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     sock.bind(('localhost', port))
     sock.listen(1)
-    print(f"En attente de connexion Simulink sur le port {port}...")
+    log.info(f"En attente de connexion Simulink sur le port {port}...")
     try:
         connection, addr = sock.accept()
-        connection.settimeout(0.05)  # Timeout plus court
-        print(f"Connexion Simulink établie depuis {addr}")
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Pas d'attente Nagle
+        connection.setblocking(False)  # Lecture et écriture bornées par select() (receive_data, _send_frame)
+        log.info(f"Connexion Simulink établie depuis {addr}")
         return connection, sock
     except Exception as e:
-        print(f"Erreur connexion TCP: {e}")
+        log.error(f"Erreur connexion TCP: {e}")
         sock.close()
         return None, None
 
 def send_data(conn, data):
     try:
-        for key in ['MIO_Distance', 'MIO_Velocity', 'Ego_Velocity']:
-            conn.sendall(struct.pack('d', float(data[key])))
-        print(f"[SEND] {data}")
+        SEND_FMT.pack_into(
+            _tx, HEADER_FMT.size,
+            float(data['MIO_Distance']),
+            float(data['MIO_Velocity']),
+            float(data['Ego_Velocity'])
+        )
+        _send_frame(conn, _tx)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"[SEND] {data}")
+    except ConnectionError:
+        raise  # Remontée à la boucle principale qui désactive la liaison TCP
     except Exception as e:
-        print(f"[ERREUR SEND]: {e}")
+        log.error(f"[ERREUR SEND]: {e}")
+
+def _send_frame(conn, frame, timeout=0.5):
+    """sendall pour la socket non bloquante : attend qu'elle soit inscriptible, sans tronquer la trame"""
+    view = memoryview(frame)
+    deadline = time.perf_counter() + timeout
+    while view:
+        remaining = max(0.0, deadline - time.perf_counter())
+        _, writable, _ = select.select([], [conn], [], remaining)
+        if not writable:
+            # Simulink ne lit plus : une trame partielle désynchroniserait le flux
+            raise ConnectionError("Envoi Simulink bloqué, trame non transmise en entier")
+        try:
+            sent = conn.send(view)
+        except BlockingIOError:
+            continue
+        view = view[sent:]
 
-def receive_data(conn):
+def receive_data(conn, deadline=0.02):
+    """Lit la réponse Simulink sans dépasser `deadline` secondes (budget pris sur le tick de 50 ms)"""
     try:
-        data = []
-        for _ in range(5):
-            packet = conn.recv(8)
-            if len(packet) < 8:
-                raise ValueError("Packet incomplet")
-            data.append(struct.unpack('d', packet)[0])
+        start = time.perf_counter()
+        remaining = deadline
+        data = _pop_latest_frame()
+        while data is None:
+            ready, _, _ = select.select([conn], [], [], remaining)
+            if not ready:
+                # Pas de réponse dans le budget : valeurs par défaut, la trame partielle est conservée
+                return _default_sim_data()
+            n = conn.recv_into(_rx_view)
+            if n == 0:
+                raise ConnectionError("Connexion Simulink fermée")
+            _rx_pending.extend(_rx_view[:n])
+            data = _pop_latest_frame()
+            remaining = max(0.0, deadline - (time.perf_counter() - start))
+        
         sim_data = {
             'egoCarStop': bool(round(data[0])),
             'FCW_Activate': bool(round(data[1])),
@@ -59,26 +148,47 @@ def receive_data(conn):
             'AEB_Status': bool(round(data[3])),
             'Emergency_Brake': bool(round(data[4]))
         }
-        print(f"[RECV] {sim_data}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"[RECV] {sim_data}")
         return sim_data
-    except socket.timeout:
-        # Timeout normal - retourner les dernières valeurs ou valeurs par défaut
-        return {
-            'egoCarStop': False,
-            'FCW_Activate': False,
-            'Deceleration': 0.0,
-            'AEB_Status': False,
-            'Emergency_Brake': False
-        }
+    except ConnectionError:
+        raise  # Remontée à la boucle principale qui désactive la liaison TCP
     except Exception as e:
-        print(f"[ERREUR RECV]: {e}")
-        return {
-            'egoCarStop': False,
-            'FCW_Activate': False,
-            'Deceleration': 0.0,
-            'AEB_Status': False,
-            'Emergency_Brake': False
-        }
+        log.error(f"[ERREUR RECV]: {e}")
+        return _default_sim_data()
+
+def _pop_latest_frame():
+    """Décode la trame complète la plus récente de _rx_pending (None si aucune)"""
+    data = None
+    while True:
+        start = _rx_pending.find(_MAGIC)
+        if start < 0:
+            # Aucun marqueur : on ne garde que ce qui pourrait être le début du suivant
+            del _rx_pending[:max(0, len(_rx_pending) - len(_MAGIC) + 1)]
+            return data
+        del _rx_pending[:start]  # Resynchronisation : octets parasites avant le marqueur
+        if len(_rx_pending) < HEADER_FMT.size:
+            return data
+        _, length = HEADER_FMT.unpack_from(_rx_pending)
+        if length != RECV_FMT.size:
+            del _rx_pending[:len(_MAGIC)]  # Entête invalide : recherche du marqueur suivant
+            continue
+        end = HEADER_FMT.size + length
+        if len(_rx_pending) < end:
+            return data
+        # Plusieurs trames en attente : seule la plus récente est conservée
+        data = RECV_FMT.unpack_from(_rx_pending, HEADER_FMT.size)
+        del _rx_pending[:end]
+
+def _default_sim_data():
+    """Commandes neutres (pas de freinage) utilisées sans réponse Simulink"""
+    return {
+        'egoCarStop': False,
+        'FCW_Activate': False,
+        'Deceleration': 0.0,
+        'AEB_Status': False,
+        'Emergency_Brake': False
+    }
 
 def initialize_carla():
     client = carla.Client('localhost', 2000)
@@ -106,7 +216,7 @@ def setup_weather_night_rain(world):
         wetness=90.0               # Route très mouillée
     )
     world.set_weather(weather)
-    print("[INFO] Conditions météo appliquées: NUIT + PLUIE FORTE")
+    log.info("[INFO] Conditions météo appliquées: NUIT + PLUIE FORTE")
 
 def setup_street_lighting(world):
     """Active l'éclairage public nocturne - Compatible CARLA 0.9.10"""
@@ -121,12 +231,17 @@ def setup_street_lighting(world):
                 light.turn_on()
                 lights_count += 1
         
-        print(f"[INFO] {lights_count} éclairages publics activés")
+        log.info(f"[INFO] {lights_count} éclairages publics activés")
     except Exception as e:
-        print(f"[WARNING] Impossible d'activer l'éclairage public: {e}")
-        print("[INFO] Simulation sans éclairage public automatique")
+        log.warning(f"[WARNING] Impossible d'activer l'éclairage public: {e}")
+        log.info("[INFO] Simulation sans éclairage public automatique")
+
+def destroy_vehicles(client, world):
+    """Détruit tous les véhicules en un seul aller-retour serveur (attend la confirmation)"""
+    vehicles = world.get_actors().filter('vehicle.*')
+    client.apply_batch_sync([carla.command.DestroyActor(actor.id) for actor in vehicles])
 
-def spawn_actors(world):
+def spawn_actors(client, world):
     bp_lib = world.get_blueprint_library()
 
     # Véhicule ego avec phares
@@ -137,10 +252,9 @@ def spawn_actors(world):
     cyclist_bp = bp_lib.find('vehicle.bh.crossbike')
     cyclist_spawn = carla.Transform(carla.Location(x=8.0, y=-17.0, z=0.3), carla.Rotation(yaw=-87))
 
-    # Nettoyage
-    for actor in world.get_actors().filter('vehicle.*'):
-        actor.destroy()
-    time.sleep(0.5)
+    # Nettoyage (mode synchrone : un tick suffit à appliquer les destructions)
+    destroy_vehicles(client, world)
+    world.tick()
 
     ego = world.spawn_actor(ego_bp, ego_spawn)
     cyclist = world.spawn_actor(cyclist_bp, cyclist_spawn)
@@ -154,50 +268,67 @@ def spawn_actors(world):
         if hasattr(carla.VehicleLightState, 'HighBeam'):
             lights |= carla.VehicleLightState.HighBeam
         ego.set_light_state(carla.VehicleLightState(lights))
-        print("[INFO] Phares du véhicule ego activés")
+        log.info("[INFO] Phares du véhicule ego activés")
     except Exception as e:
-        print(f"[WARNING] Impossible d'activer les phares: {e}")
+        log.warning(f"[WARNING] Impossible d'activer les phares: {e}")
     
-    print("[INFO] Véhicules spawned avec tentative d'éclairage nocturne")
+    log.info("[INFO] Véhicules spawned avec tentative d'éclairage nocturne")
 
     return ego, cyclist
 
-def control_cyclist(cyclist, sim_time):
+def control_cyclist(sim_time):
     if sim_time > 2.0:
-        cyclist.apply_control(carla.VehicleControl(throttle=0.4, steer=0.0))
+        return carla.VehicleControl(throttle=0.4, steer=0.0)
     else:
-        cyclist.apply_control(carla.VehicleControl(throttle=0.0, brake=1.0))
+        return carla.VehicleControl(throttle=0.0, brake=1.0)
 
-def control_ego(ego, sim_time, sim_data, collision):
+def control_ego(sim_time, emergency_brake, ego_stop, collision, deceleration):
     # Adaptation pour conditions nocturnes et pluvieuses
     # Réduction de la vitesse de base en conditions difficiles
     base_throttle = 0.5  # Réduit par rapport aux 0.6 initiaux
     
-    if sim_data['Emergency_Brake'] or sim_data['egoCarStop'] or collision:
-        return carla.VehicleControl(throttle=0.0, brake=1.0)
-    if sim_time > 2.0:
-        # Freinage plus progressif en conditions glissantes
-        decel_factor = min(0.8, sim_data['Deceleration'])  # Limité pour éviter le blocage
-        return carla.VehicleControl(
-            throttle=max(0.6, base_throttle - decel_factor),
-            brake=min(0.8, decel_factor),  # Freinage moins agressif sur route mouillée
-            steer=0.0
-        )
-    else:
+    if emergency_brake or ego_stop or collision or sim_time <= 2.0:
         return carla.VehicleControl(throttle=0.0, brake=1.0)
+    # Freinage plus progressif en conditions glissantes
+    # Bornes écrites en comparaisons directes (plus rapides que min/max variadiques)
+    decel_factor = deceleration if deceleration < 0.8 else 0.8  # Limité pour éviter le blocage
+    throttle = base_throttle - decel_factor
+    return carla.VehicleControl(
+        throttle=throttle if throttle > 0.6 else 0.6,
+        brake=decel_factor,  # Freinage moins agressif sur route mouillée (déjà borné à 0.8)
+        steer=0.0
+    )
+
+def render_text(cache, font, text, color):
+    """Rendu pygame mis en cache : une Surface SDL par (police, texte, couleur)"""
+    key = (font, text, color)
+    surface = cache.get(key)
+    if surface is None:
+        if len(cache) >= 2048:  # Borne la mémoire sur les longues simulations
+            cache.clear()
+        surface = font.render(text, True, color)
+        cache[key] = surface
+    return surface
 
 class RealTimePlotter:
     def __init__(self, max_points=200):
         self.max_points = max_points
-        self.times = deque(maxlen=max_points)
-        self.distances = deque(maxlen=max_points)
-        self.ttc_values = deque(maxlen=max_points)
-        self.ego_speeds = deque(maxlen=max_points)
-        self.cyclist_speeds = deque(maxlen=max_points)
+        # Tampons circulaires préalloués : idx = nombre total d'échantillons écrits
+        self.buf_t = np.empty(max_points, dtype=np.float64)
+        self.buf_dist = np.empty(max_points, dtype=np.float64)
+        self.buf_ttc = np.empty(max_points, dtype=np.float64)
+        self.buf_ego = np.empty(max_points, dtype=np.float64)
+        self.buf_cyc = np.empty(max_points, dtype=np.float64)
+        self.idx = 0
+        self.saved_idx = 0  # Mode Agg : idx du dernier PNG écrit
+        # Mode Agg : rendu PNG délégué à un thread unique, une image à la fois
+        self._exec = None if LIVE_PLOT else ThreadPoolExecutor(max_workers=1)
+        self._pending = None
         
-        # Configuration matplotlib pour éviter les conflits de thread
-        plt.switch_backend('TkAgg')  # Backend plus stable
-        plt.ion()
+        # Fenêtre Tk seulement en mode interactif (évite la concurrence Tk/pygame par défaut)
+        if LIVE_PLOT:
+            plt.switch_backend('TkAgg')  # Backend plus stable
+            plt.ion()
         
         try:
             self.fig, (self.ax1, self.ax2, self.ax3) = plt.subplots(3, 1, figsize=(10, 8))
@@ -231,78 +362,217 @@ class RealTimePlotter:
             self.ax3.set_title('Vitesses des Véhicules (Conditions Difficiles)')
             self.ax3.grid(True, color='gray', alpha=0.3)
             
+            # Courbes persistantes : en mode interactif, animated=True les exclut du fond mis en cache
+            # (blitting) ; en mode Agg elles doivent rester visibles pour savefig
+            self.line_dist, = self.ax1.plot([], [], color='cyan', linewidth=2, label='Distance', animated=LIVE_PLOT)
+            self.ax1.axhline(y=2.5, color='red', linestyle='--', label='Seuil collision')
+            self.line_ttc, = self.ax2.plot([], [], color='yellow', linewidth=2, label='TTC', animated=LIVE_PLOT)
+            self.ax2.axhline(y=2.0, color='orange', linestyle='--', label='TTC critique (nuit)')
+            self.line_ego, = self.ax3.plot([], [], color='lime', linewidth=2, label='Ego', animated=LIVE_PLOT)
+            self.line_cyc, = self.ax3.plot([], [], color='magenta', linewidth=2, label='Cycliste', animated=LIVE_PLOT)
+            
+            # Légendes créées une seule fois (plus de ax.legend() à chaque mise à jour)
+            for ax in [self.ax1, self.ax2, self.ax3]:
+                ax.legend()
+            
             plt.tight_layout()
-            plt.show(block=False)
+            if LIVE_PLOT:
+                plt.show(block=False)
+                # Les fonds sont recapturés à chaque rendu complet (redimensionnement, changement d'échelle)
+                self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+                self.fig.canvas.draw()
             self.plotting_enabled = True
         except Exception as e:
-            print(f"[WARNING] Impossible d'initialiser matplotlib: {e}")
-            print("[INFO] Continuer sans graphiques temps réel")
+            log.warning(f"[WARNING] Impossible d'initialiser matplotlib: {e}")
+            log.info("[INFO] Continuer sans graphiques temps réel")
             self.plotting_enabled = False
     
+    def _on_draw(self, event):
+        """Sauvegarde le fond de chaque axe après un rendu complet"""
+        canvas = self.fig.canvas
+        self.bg1 = canvas.copy_from_bbox(self.ax1.bbox)
+        self.bg2 = canvas.copy_from_bbox(self.ax2.bbox)
+        self.bg3 = canvas.copy_from_bbox(self.ax3.bbox)
+    
     def update(self, time_val, distance, ttc, ego_speed, cyclist_speed):
+        """Enregistre un échantillon ; le rendu est déclenché séparément par redraw()"""
         if not self.plotting_enabled:
             return
             
+        i = self.idx % self.max_points
+        self.buf_t[i] = time_val
+        self.buf_dist[i] = distance
+        self.buf_ttc[i] = min(ttc, 10)
+        self.buf_ego[i] = ego_speed
+        self.buf_cyc[i] = cyclist_speed
+        self.idx += 1
+    
+    def redraw(self):
+        if not self.plotting_enabled or self.idx == 0:
+            return
+        if LIVE_PLOT:
+            # Tk n'est pas thread-safe : rendu dans le thread propriétaire de la fenêtre
+            self._update_plots(*self._snapshot())
+            return
+        # Mode Agg : une image tous les 20 ticks suffit pour suivre le PNG
+        if self.idx - self.saved_idx < 20:
+            return
+        if self._pending is not None and not self._pending.done():
+            return  # Image précédente encore en cours : celle-ci est sautée
+        self.saved_idx = self.idx
+        # Copies indépendantes : le thread de rendu ne lit jamais les tampons en cours d'écriture
+        self._pending = self._exec.submit(self._update_plots, *self._snapshot(copy=True))
+    
+    def close(self):
+        """Attend le rendu en cours puis écrit la dernière image (mode Agg)"""
+        if self._exec is not None:
+            self._exec.shutdown(wait=True)
+            if self.plotting_enabled and self.idx > self.saved_idx:
+                self._update_plots(*self._snapshot())
+        plt.close('all')
+    
+    def _snapshot(self, copy=False):
+        """(temps, distance, TTC, vitesse ego, vitesse cycliste) ordonnés pour set_data"""
+        return tuple(
+            self._ordered(buf, copy)
+            for buf in (self.buf_t, self.buf_dist, self.buf_ttc, self.buf_ego, self.buf_cyc)
+        )
+    
+    def _ordered(self, buf, copy=False):
+        """Échantillons du plus ancien au plus récent (vue directe tant que le tampon n'a pas bouclé)"""
+        if self.idx <= self.max_points:
+            return buf[:self.idx].copy() if copy else buf[:self.idx]
+        i = self.idx % self.max_points
+        return np.concatenate((buf[i:], buf[:i]))
+    
+    def _rescale_axes(self, times, distances, ego_speeds, cyclist_speeds):
+        """Recalcule les limites seulement si les données sortent des bornes actuelles (marge de 10 %)"""
+        rescaled = False
+        
+        t_min, t_max = times[0], times[-1]
+        if t_max > self.ax1.get_xlim()[1]:
+            span = max(t_max - t_min, 1.0)
+            for ax in [self.ax1, self.ax2, self.ax3]:
+                ax.set_xlim(t_min, t_max + 0.1 * span)
+            rescaled = True
+        
+        # L'axe TTC garde des limites fixes (0-10 s)
+        for ax, series in [(self.ax1, [distances]), (self.ax3, [ego_speeds, cyclist_speeds])]:
+            y_min = min(values.min() for values in series)
+            y_max = max(values.max() for values in series)
+            low, high = ax.get_ylim()
+            if y_min < low or y_max > high:
+                margin = 0.1 * max(y_max - y_min, 1.0)
+                ax.set_ylim(y_min - margin, y_max + margin)
+                rescaled = True
+        
+        return rescaled
+    
+    def _update_plots(self, times, distances, ttc_values, ego_speeds, cyclist_speeds):
         try:
-            self.times.append(time_val)
-            self.distances.append(distance)
-            self.ttc_values.append(min(ttc, 10))
-            self.ego_speeds.append(ego_speed)
-            self.cyclist_speeds.append(cyclist_speed)
+            self.line_dist.set_data(times, distances)
+            self.line_ttc.set_data(times, ttc_values)
+            self.line_ego.set_data(times, ego_speeds)
+            self.line_cyc.set_data(times, cyclist_speeds)
             
-            # Mise à jour moins fréquente pour éviter les conflits
-            if len(self.times) % 5 == 0:  # Mise à jour tous les 5 points
-                self._update_plots()
+            rescaled = self._rescale_axes(times, distances, ego_speeds, cyclist_speeds)
+            if LIVE_PLOT:
+                self._blit(rescaled)
+            else:
+                self._save_frame()
         except Exception as e:
-            print(f"[WARNING] Erreur matplotlib: {e}")
+            log.warning(f"[WARNING] Erreur mise à jour graphique: {e}")
             self.plotting_enabled = False
     
-    def _update_plots(self):
+    def _blit(self, rescaled):
+        canvas = self.fig.canvas
+        if rescaled:
+            # Rendu complet uniquement quand les échelles changent ; _on_draw recapture les fonds
+            canvas.draw()
+        
+        # Blitting : restauration du fond puis dessin des seules courbes
+        canvas.restore_region(self.bg1)
+        self.ax1.draw_artist(self.line_dist)
+        canvas.blit(self.ax1.bbox)
+        
+        canvas.restore_region(self.bg2)
+        self.ax2.draw_artist(self.line_ttc)
+        canvas.blit(self.ax2.bbox)
+        
+        canvas.restore_region(self.bg3)
+        self.ax3.draw_artist(self.line_ego)
+        self.ax3.draw_artist(self.line_cyc)
+        canvas.blit(self.ax3.bbox)
+        
+        canvas.flush_events()
+    
+    def _save_frame(self):
+        """Écrit le PNG via un fichier temporaire : un visualiseur ne lit jamais une image partielle"""
+        tmp_file = LIVE_PLOT_FILE + '.tmp.png'
+        self.fig.savefig(tmp_file, facecolor=self.fig.get_facecolor())
+        os.replace(tmp_file, LIVE_PLOT_FILE)
+    
+    def process_events(self):
+        """Garde la fenêtre réactive lorsqu'aucun échantillon n'arrive"""
+        if self.plotting_enabled:
+            self.fig.canvas.flush_events()
+
+def _plotter_process(samples, max_points):
+    """Boucle du processus de rendu : vide la file puis redessine une fois par lot"""
+    plotter = RealTimePlotter(max_points)
+    running = plotter.plotting_enabled
+    
+    while running:
+        batch = []
         try:
-            # Couleurs adaptées au thème nocturne
-            # Mise à jour des graphiques
-            self.ax1.clear()
-            self.ax1.set_facecolor('black')
-            self.ax1.plot(list(self.times), list(self.distances), color='cyan', linewidth=2, label='Distance')
-            self.ax1.axhline(y=2.5, color='red', linestyle='--', label='Seuil collision')
-            self.ax1.set_ylabel('Distance (m)', color='white')
-            self.ax1.set_title('Distance Ego-Cycliste (Nuit + Pluie)', color='white')
-            self.ax1.legend()
-            self.ax1.grid(True, color='gray', alpha=0.3)
-            self.ax1.tick_params(colors='white')
-            
-            self.ax2.clear()
-            self.ax2.set_facecolor('black')
-            self.ax2.plot(list(self.times), list(self.ttc_values), color='yellow', linewidth=2, label='TTC')
-            self.ax2.axhline(y=2.0, color='orange', linestyle='--', label='TTC critique (nuit)')
-            self.ax2.set_ylabel('TTC (s)', color='white')
-            self.ax2.set_title('Time-To-Collision (Visibilité Réduite)', color='white')
-            self.ax2.set_ylim(0, 10)
-            self.ax2.legend()
-            self.ax2.grid(True, color='gray', alpha=0.3)
-            self.ax2.tick_params(colors='white')
-            
-            self.ax3.clear()
-            self.ax3.set_facecolor('black')
-            self.ax3.plot(list(self.times), list(self.ego_speeds), color='lime', linewidth=2, label='Ego')
-            self.ax3.plot(list(self.times), list(self.cyclist_speeds), color='magenta', linewidth=2, label='Cycliste')
-            self.ax3.set_ylabel('Vitesse (m/s)', color='white')
-            self.ax3.set_xlabel('Temps (s)', color='white')
-            self.ax3.set_title('Vitesses des Véhicules (Conditions Difficiles)', color='white')
-            self.ax3.legend()
-            self.ax3.grid(True, color='gray', alpha=0.3)
-            self.ax3.tick_params(colors='white')
-            
-            plt.draw()
-            plt.pause(0.001)  # Pause très courte
-        except Exception as e:
-            print(f"[WARNING] Erreur mise à jour graphique: {e}")
-            self.plotting_enabled = False
+            batch.append(samples.get(timeout=0.1))
+            while True:
+                batch.append(samples.get_nowait())
+        except queue.Empty:
+            pass
+        
+        # None = sentinelle d'arrêt envoyée par PlotterClient.close()
+        if None in batch:
+            batch = batch[:batch.index(None)]
+            running = False
+        
+        if batch:
+            for sample in batch[-max_points:]:
+                plotter.update(*sample)
+            plotter.redraw()
+        else:
+            plotter.process_events()
+    
+    plotter.close()
+
+class PlotterClient:
+    """Client léger : transmet les échantillons au processus propriétaire de matplotlib"""
+    def __init__(self, max_points=200):
+        self.queue = multiprocessing.Queue(maxsize=4)
+        self.proc = multiprocessing.Process(target=_plotter_process, args=(self.queue, max_points), daemon=True)
+        self.proc.start()
+    
+    def update(self, time_val, distance, ttc, ego_speed, cyclist_speed):
+        try:
+            self.queue.put_nowait((time_val, distance, ttc, ego_speed, cyclist_speed))
+        except queue.Full:
+            pass  # Rendu en retard : l'échantillon est abandonné plutôt que de bloquer la boucle CARLA
+    
+    def close(self):
+        try:
+            self.queue.put(None, timeout=0.5)
+        except queue.Full:
+            pass
+        self.proc.join(timeout=2)
+        if self.proc.is_alive():
+            self.proc.terminate()
 
 def main():
     conn = None
     sock = None
+    client = None
     world = None
+    plotter = None
     
     try:
         pygame.init()
@@ -310,6 +580,21 @@ def main():
         pygame.display.set_caption("HUD - Simulation AEB Nocturne + Pluie")
         font = pygame.font.Font(None, 24)
         font_small = pygame.font.Font(None, 18)
+        hud_cache = {}
+        
+        # Fond du HUD rendu une seule fois : couleur de fond + éléments fixes
+        hud_background = pygame.Surface(screen.get_size())
+        hud_background.fill((10, 10, 30))  # Bleu très sombre
+        hud_static = [
+            (font_small.render("CONDITIONS: NUIT + PLUIE FORTE", True, (100, 200, 255)), (10, 35)),  # Bleu clair
+            (font_small.render("Visibilité: RÉDUITE", True, (255, 255, 0)), (10, 60 + 5 * 20)),  # Jaune vif
+            (font_small.render("Éclairage: ACTIVÉ", True, (0, 255, 100)), (10, 60 + 11 * 20))  # Vert clair
+        ]
+        for surface, pos in hud_static:
+            hud_background.blit(surface, pos)
+        # Dernier rendu de chaque élément dynamique : position -> (surface, rect)
+        hud_drawn = {}
+        hud_full_redraw = True
 
         client, world = initialize_carla()
         
@@ -319,51 +604,58 @@ def main():
         # Activation de l'éclairage public
         setup_street_lighting(world)
         
-        ego, cyclist = spawn_actors(world)
+        ego, cyclist = spawn_actors(client, world)
+        spectator = world.get_spectator()  # Handle stable pour toute la session
         
         # Tentative de connexion TCP (optionnelle)
         conn, sock = setup_tcp_server(9001)
         tcp_active = conn is not None
         
         if not tcp_active:
-            print("[WARNING] Simulation sans connexion Simulink")
+            log.warning("[WARNING] Simulation sans connexion Simulink")
         
-        # Initialisation du traceur temps réel
-        plotter = RealTimePlotter()
+        # Initialisation du traceur temps réel (processus séparé)
+        plotter = PlotterClient()
+        if not LIVE_PLOT:
+            log.info(f"[INFO] Graphiques écrits dans {LIVE_PLOT_FILE} (AEB_LIVE_PLOT=1 pour une fenêtre interactive)")
 
         clock = pygame.time.Clock()
         sim_time = 0.0
         collision = False
-        
-        # Données par défaut si pas de connexion Simulink
-        # Seuils ajustés pour conditions nocturnes
-        default_sim_data = {
-            'egoCarStop': False,
-            'FCW_Activate': False,
-            'Deceleration': 0.0,
-            'AEB_Status': False,
-            'Emergency_Brake': False
-        }
 
-        print("[INFO] Simulation démarrée avec conditions NOCTURNES + PLUIE")
+        # Compilation JIT (ou chargement du cache) avant la boucle temps réel
+        aeb_step(1.0, 1.0, 1.0)
+
+        log.info("[INFO] Simulation démarrée avec conditions NOCTURNES + PLUIE")
 
         while True:
             for e in pygame.event.get():
                 if e.type == pygame.QUIT:
                     return
+                if e.type == pygame.VIDEOEXPOSE:
+                    hud_full_redraw = True  # Fenêtre à repeindre entièrement
 
             world.tick()
             sim_time += 0.05
 
-            control_cyclist(cyclist, sim_time)
-
-            distance = ego.get_location().distance(cyclist.get_location())
+            cyclist_ctrl = control_cyclist(sim_time)
+
+            # Une seule requête RPC par véhicule : la transformée contient position et orientation
+            ego_transform = ego.get_transform()
+            ego_location = ego_transform.location
+            cyclist_location = cyclist.get_transform().location
+            # Distance au carré pour les seuils ; une seule racine pour TTC, TCP et affichage
+            dx = ego_location.x - cyclist_location.x
+            dy = ego_location.y - cyclist_location.y
+            dz = ego_location.z - cyclist_location.z
+            distance_sq = dx*dx + dy*dy + dz*dz
+            distance = math.sqrt(distance_sq)
             ego_speed = get_speed(ego)
             cyclist_speed = get_speed(cyclist)
             
             # Calcul vitesse relative et TTC
             relative_velocity = ego_speed - cyclist_speed
-            ttc = calculate_ttc(distance, relative_velocity)
+            ttc, aeb_status, emergency_brake, deceleration = aeb_step(distance, distance_sq, relative_velocity)
 
             # Communication TCP (si active)
             if tcp_active and conn:
@@ -375,119 +667,128 @@ def main():
                     })
                     sim_data = receive_data(conn)
                 except Exception as e:
-                    print(f"[TCP ERROR]: {e}")
+                    log.error(f"[TCP ERROR]: {e}")
                     tcp_active = False
-                    sim_data = default_sim_data
+                    sim_data = _default_sim_data()
             else:
-                # Simulation AEB adaptée aux conditions nocturnes
-                sim_data = default_sim_data.copy()
-                # Seuils plus conservateurs la nuit
-                if distance < 15.0 and relative_velocity > 0:  # Détection plus précoce
-                    sim_data['AEB_Status'] = True
-                    if distance < 8.0:  # Freinage d'urgence plus tôt
-                        sim_data['Emergency_Brake'] = True
-                        sim_data['Deceleration'] = min(0.8, 15.0/distance)  # Freinage plus doux sur route mouillée
-
-            ctrl = control_ego(ego, sim_time, sim_data, collision)
-            ego.apply_control(ctrl)
-
-            if distance < 2.5 and not collision:
-                print("[COLLISION] DETECTED!")
+                # Simulation AEB adaptée aux conditions nocturnes (calculée par aeb_step)
+                sim_data = _default_sim_data()
+                sim_data['Deceleration'] = deceleration
+                sim_data['AEB_Status'] = aeb_status
+                sim_data['Emergency_Brake'] = emergency_brake
+
+            ctrl = control_ego(
+                sim_time,
+                sim_data['Emergency_Brake'],
+                sim_data['egoCarStop'],
+                collision,
+                sim_data['Deceleration']
+            )
+            # Commandes cycliste + ego envoyées en un seul aller-retour (appliquées au prochain tick)
+            client.apply_batch([
+                carla.command.ApplyVehicleControl(cyclist.id, cyclist_ctrl),
+                carla.command.ApplyVehicleControl(ego.id, ctrl)
+            ])
+
+            if distance_sq < 6.25 and not collision:  # 2.5 m
+                log.warning("[COLLISION] DETECTED!")
                 collision = True
 
-            # Mise à jour du graphique temps réel
+            # Mise à jour du graphique temps réel (non bloquant)
             plotter.update(sim_time, distance, ttc, ego_speed, cyclist_speed)
 
-            # HUD adapté au thème nocturne
-            screen.fill((10, 10, 30))  # Bleu très sombre
-            
-            # Titre avec statut connexion
-            title_text = "SIMULATION AEB - NUIT + PLUIE"
-            if not tcp_active:
-                title_text += " (SANS SIMULINK)"
-            title = font.render(title_text, True, (255, 255, 100))  # Jaune pour la nuit
-            screen.blit(title, (10, 10))
-            
-            # Indicateur conditions météo
-            weather_text = "CONDITIONS: NUIT + PLUIE FORTE"
-            weather = font_small.render(weather_text, True, (100, 200, 255))  # Bleu clair
-            screen.blit(weather, (10, 35))
-            
-            hud_lines = [
-                f"Vitesse Ego: {ego_speed*3.6:.1f} km/h",
-                f"Vitesse Cycliste: {cyclist_speed*3.6:.1f} km/h",
-                f"Distance: {distance:.2f} m",
-                f"TTC: {ttc:.2f} s" if ttc != float('inf') else "TTC: ∞",
-                f"Vitesse Relative: {relative_velocity:.2f} m/s",
-                f"Visibilité: RÉDUITE",
-                "",
-                f"Accélérateur: {ctrl.throttle:.2f}",
-                f"Frein: {ctrl.brake:.2f}",
-                f"Freinage Urgence: {sim_data['Emergency_Brake']}",
-                f"AEB Actif: {sim_data['AEB_Status']}",
-                f"Éclairage: ACTIVÉ",
-                f"Collision: {collision}",
-                f"TCP: {'Actif' if tcp_active else 'Inactif'}"
-            ]
-            
-            for i, text in enumerate(hud_lines):
-                if text == "":
-                    continue
-                color = (200, 200, 200)  # Gris clair par défaut
-                if "Collision: True" in text:
-                    color = (255, 50, 50)  # Rouge vif
-                elif "Freinage Urgence: True" in text or "AEB Actif: True" in text:
-                    color = (255, 150, 0)  # Orange
-                elif "TTC:" in text and ttc < 3.0 and ttc != float('inf'):  # Seuil augmenté pour la nuit
-                    color = (255, 100, 100)  # Rouge clair
-                elif "TCP: Inactif" in text:
-                    color = (255, 200, 0)  # Jaune
-                elif "Visibilité: RÉDUITE" in text:
-                    color = (255, 255, 0)  # Jaune vif
-                elif "Éclairage: ACTIVÉ" in text:
-                    color = (0, 255, 100)  # Vert clair
+            # HUD adapté au thème nocturne, redessiné seulement si la fenêtre est visible
+            # (fenêtre réduite ou masquée : la simulation CARLA continue sans rendu texte)
+            if pygame.display.get_active():
+                if hud_full_redraw:
+                    screen.blit(hud_background, (0, 0))
+                    hud_drawn.clear()
                 
-                txt = font_small.render(text, True, color)
-                screen.blit(txt, (10, 60 + i * 20))
-            
-            pygame.display.flip()
+                # Titre avec statut connexion
+                title_text = "SIMULATION AEB - NUIT + PLUIE"
+                if not tcp_active:
+                    title_text += " (SANS SIMULINK)"
+                hud_items = [((10, 10), render_text(hud_cache, font, title_text, (255, 255, 100)))]  # Jaune pour la nuit
+                
+                # (ligne, texte) - valeurs formatées à la précision affichée : texte identique => Surface réutilisée
+                hud_lines = [
+                    (0, f"Vitesse Ego: {ego_speed*3.6:.1f} km/h"),
+                    (1, f"Vitesse Cycliste: {cyclist_speed*3.6:.1f} km/h"),
+                    (2, f"Distance: {distance:.2f} m"),
+                    (3, f"TTC: {ttc:.2f} s" if ttc != float('inf') else "TTC: ∞"),
+                    (4, f"Vitesse Relative: {relative_velocity:.2f} m/s"),
+                    (7, f"Accélérateur: {ctrl.throttle:.2f}"),
+                    (8, f"Frein: {ctrl.brake:.2f}"),
+                    (9, f"Freinage Urgence: {sim_data['Emergency_Brake']}"),
+                    (10, f"AEB Actif: {sim_data['AEB_Status']}"),
+                    (12, f"Collision: {collision}"),
+                    (13, f"TCP: {'Actif' if tcp_active else 'Inactif'}")
+                ]
+                
+                for i, text in hud_lines:
+                    color = (200, 200, 200)  # Gris clair par défaut
+                    if "Collision: True" in text:
+                        color = (255, 50, 50)  # Rouge vif
+                    elif "Freinage Urgence: True" in text or "AEB Actif: True" in text:
+                        color = (255, 150, 0)  # Orange
+                    elif "TTC:" in text and ttc < 3.0 and ttc != float('inf'):  # Seuil augmenté pour la nuit
+                        color = (255, 100, 100)  # Rouge clair
+                    elif "TCP: Inactif" in text:
+                        color = (255, 200, 0)  # Jaune
+                    
+                    hud_items.append(((10, 60 + i * 20), render_text(hud_cache, font_small, text, color)))
+                
+                # Seuls les éléments dont la Surface a changé sont effacés, redessinés et envoyés à l'écran
+                dirty_rects = []
+                for pos, txt in hud_items:
+                    previous_txt, old_rect = hud_drawn.get(pos, (None, None))
+                    if txt is previous_txt:
+                        continue
+                    if old_rect is not None:
+                        screen.blit(hud_background, old_rect, old_rect)  # Efface l'ancien texte
+                    rect = screen.blit(txt, pos)
+                    hud_drawn[pos] = (txt, rect)
+                    dirty_rects.append(rect if old_rect is None else rect.union(old_rect))
+                
+                if hud_full_redraw:
+                    pygame.display.flip()
+                    hud_full_redraw = False
+                elif dirty_rects:
+                    pygame.display.update(dirty_rects)
+            else:
+                hud_full_redraw = True  # Contenu perdu pendant l'inactivité : repeindre au retour
 
             # Caméra spectateur optimisée pour conditions nocturnes
-            spectator = world.get_spectator()
-            ego_location = ego.get_location()
-            ego_rotation = ego.get_transform().rotation
+            yaw = ego_transform.rotation.yaw
             
             # Vue suiveur rapprochée pour compenser la visibilité réduite
-            import math
-            yaw_rad = math.radians(ego_rotation.yaw)
-            camera_x = ego_location.x - 15 * math.cos(yaw_rad)  # Plus proche (15m au lieu de 20m)
-            camera_y = ego_location.y - 15 * math.sin(yaw_rad)
+            yaw_rad = math.radians(yaw)
+            cos_yaw, sin_yaw = math.cos(yaw_rad), math.sin(yaw_rad)
+            camera_x = ego_location.x - 15 * cos_yaw  # Plus proche (15m au lieu de 20m)
+            camera_y = ego_location.y - 15 * sin_yaw
             camera_z = ego_location.z + 8  # Un peu plus bas pour meilleure visibilité
             camera_location = carla.Location(x=camera_x, y=camera_y, z=camera_z)
-            camera_rotation = carla.Rotation(pitch=-20, yaw=ego_rotation.yaw, roll=0)
+            camera_rotation = carla.Rotation(pitch=-20, yaw=yaw, roll=0)
             
             spectator.set_transform(carla.Transform(camera_location, camera_rotation))
 
             clock.tick(20)
 
     except KeyboardInterrupt:
-        print("\n[INFO] Arrêt demandé par l'utilisateur")
+        log.info("[INFO] Arrêt demandé par l'utilisateur")
     except Exception as e:
-        print(f"Erreur principale : {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"Erreur principale : {e}")
     finally:
-        print("Nettoyage...")
+        log.info("Nettoyage...")
         try:
             if conn:
                 conn.close()
             if sock:
                 sock.close()
-            if world:
-                for actor in world.get_actors().filter('vehicle.*'):
-                    actor.destroy()
+            if client and world:
+                destroy_vehicles(client, world)
         except Exception as e:
-            print(f"Erreur nettoyage: {e}")
+            log.error(f"Erreur nettoyage: {e}")
         
         try:
             pygame.quit()
@@ -495,12 +796,21 @@ def main():
             pass
         
         try:
-            plt.close('all')
+            if plotter:
+                plotter.close()
         except:
             pass
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scénario AEB Car-to-Bicyclist (nuit + pluie)")
+    parser.add_argument('--verbose', action='store_true', help="Trace les échanges Simulink à chaque tick")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s')
+    log.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    
     print(">>> Lancement du test AEB vs Cycliste - CONDITIONS NOCTURNES + PLUIE")
     print(">>> Fonctionnalités: Nuit, Pluie forte, Éclairage, Visibilité réduite")
     print(">>> Seuils AEB adaptés aux conditions difficiles")
+    # 'spawn' : le processus de rendu initialise Tk/matplotlib dans un interpréteur neuf
+    multiprocessing.set_start_method('spawn')
     main()
\ No newline at end of file